@@ -4,12 +4,98 @@ This code contains the DatabaseManager class that handles database updates
 Author: Winston Olson-Duvall, winston.olson-duvall@jpl.nasa.gov
 """
 
+import collections
 import datetime
+import functools
+import os
+import pickle
+import threading
+import time
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from emit_main.config.config import Config
 
+# MongoClient instances are thread-safe and maintain their own connection pools, so share them across
+# DatabaseManager instances. Key on the process id as well since clients must not be reused after a fork.
+_CLIENTS = {}
+
+
+def _get_client(config):
+    key = (os.getpid(), config["db_host"], config["db_port"], config["db_user"], config["db_name"])
+    if key not in _CLIENTS:
+        _CLIENTS[key] = MongoClient(config["db_host"], config["db_port"], username=config["db_user"],
+                                    password=config["db_password"], authSource=config["db_name"],
+                                    authMechanism="SCRAM-SHA-256")
+    return _CLIENTS[key]
+
+
+# Results of lookups by id and by orbit are cached for a short time so that repeated lookups of the same thing (e.g.
+# while Luigi checks task outputs) don't each go to the DB. The date range queries used by the monitors return many
+# documents and are only made once per pass, so they aren't cached. The cache is local to the process and is cleared
+# on any write.
+_QUERY_CACHE_MAXSIZE = 1024
+_QUERY_CACHE_TTL = 30
+_query_cache = collections.OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_pid = None
+# Incremented on every clear so that a query that was running during a write doesn't store its result
+_query_cache_generation = 0
+
+
+def _clear_query_cache():
+    global _query_cache_generation
+    with _query_cache_lock:
+        _query_cache.clear()
+        _query_cache_generation += 1
+
+
+def _cached_query(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        global _query_cache_pid
+        key = (self.config["db_name"], self.config["build_num"], func.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return func(self, *args, **kwargs)
+        with _query_cache_lock:
+            # Don't use results cached by a parent process before a fork
+            if _query_cache_pid != os.getpid():
+                _query_cache.clear()
+                _query_cache_pid = os.getpid()
+            if key in _query_cache:
+                expiration, pickled_result = _query_cache[key]
+                if expiration > time.monotonic():
+                    _query_cache.move_to_end(key)
+                    # Callers often modify the results, so hand out copies
+                    return pickle.loads(pickled_result)
+                del _query_cache[key]
+            generation = _query_cache_generation
+        result = func(self, *args, **kwargs)
+        # Results are stored pickled, which is much cheaper than deep copying them and leaves the caller free to use
+        # the result it was given
+        pickled_result = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with _query_cache_lock:
+            if generation == _query_cache_generation and _query_cache_pid == os.getpid():
+                _query_cache[key] = (time.monotonic() + _QUERY_CACHE_TTL, pickled_result)
+                while len(_query_cache) > _QUERY_CACHE_MAXSIZE:
+                    _query_cache.popitem(last=False)
+        return result
+    return wrapper
+
+
+def _invalidates_query_cache(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # Clear before as well as after so that any lookups made during the write see the current state of the DB
+        _clear_query_cache()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            _clear_query_cache()
+    return wrapper
+
 
 class DatabaseManager:
 
@@ -23,12 +109,16 @@ class DatabaseManager:
         # Get config properties
         self.config = Config(config_path).get_dictionary()
 
-        self.client = MongoClient(self.config["db_host"], self.config["db_port"], username=self.config["db_user"],
-                                  password=self.config["db_password"], authSource=self.config["db_name"],
-                                  authMechanism="SCRAM-SHA-256")
+        self.client = _get_client(self.config)
 
         self.db = self.client[self.config["db_name"]]
 
+    def invalidate(self):
+        """
+        Clear cached query results, e.g. after the DB has been updated by another process
+        """
+        _clear_query_cache()
+
     def _remove_results_with_failed_tasks(self, results, tasks):
         non_failed_results = []
         for r in results:
@@ -41,10 +131,12 @@ class DatabaseManager:
                 non_failed_results.append(r)
         return non_failed_results
 
+    @_cached_query
     def find_acquisition_by_id(self, acquisition_id):
         acquisitions_coll = self.db.acquisitions
         return acquisitions_coll.find_one({"acquisition_id": acquisition_id, "build_num": self.config["build_num"]})
 
+    @_cached_query
     def find_acquisitions_by_orbit_id(self, orbit_id, submode, min_valid_lines=0):
         acquisitions_coll = self.db.acquisitions
         query = {
@@ -268,6 +360,7 @@ class DatabaseManager:
             results = self._remove_results_with_failed_tasks(results, ["emit.L2BFormat", "emit.L2BDeliver"])
         return results
 
+    @_invalidates_query_cache
     def insert_acquisition(self, metadata):
         if self.find_acquisition_by_id(metadata["acquisition_id"]) is None:
             utc_now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -276,6 +369,7 @@ class DatabaseManager:
             acquisitions_coll = self.db.acquisitions
             acquisitions_coll.insert_one(metadata)
 
+    @_invalidates_query_cache
     def update_acquisition_metadata(self, acquisition_id, metadata):
         acquisitions_coll = self.db.acquisitions
         query = {"acquisition_id": acquisition_id, "build_num": self.config["build_num"]}
@@ -283,6 +377,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         acquisitions_coll.update_one(query, set_value, upsert=True)
 
+    @_invalidates_query_cache
     def insert_acquisition_log_entry(self, acquisition_id, entry):
         entry["extended_build_num"] = self.config["extended_build_num"]
         acquisitions_coll = self.db.acquisitions
@@ -295,6 +390,29 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         acquisitions_coll.update_one(query, set_value, upsert=True)
 
+    @_invalidates_query_cache
+    def bulk_update_acquisitions(self, updates):
+        """
+        :param updates: List of (acquisition_id, metadata, log_entry) tuples. Each acquisition's metadata is set and its
+                        log entry is pushed to the processing log in the same update, and all of the updates are
+                        submitted in a single bulk write.
+        """
+        if len(updates) == 0:
+            return
+        acquisitions_coll = self.db.acquisitions
+        ops = []
+        for acquisition_id, metadata, entry in updates:
+            entry["extended_build_num"] = self.config["extended_build_num"]
+            query = {"acquisition_id": acquisition_id, "build_num": self.config["build_num"]}
+            metadata["last_modified"] = entry["log_timestamp"]
+            update = {
+                "$set": metadata,
+                "$push": {"processing_log": entry}
+            }
+            ops.append(UpdateOne(query, update, upsert=True))
+        acquisitions_coll.bulk_write(ops, ordered=False)
+
+    @_cached_query
     def find_stream_by_name(self, name):
         streams_coll = self.db.streams
         if "hsc.bin" in name:
@@ -346,6 +464,7 @@ class DatabaseManager:
             results = self._remove_results_with_failed_tasks(results, ["emit.L0Deliver"])
         return results
 
+    @_invalidates_query_cache
     def insert_stream(self, name, metadata):
         if self.find_stream_by_name(name) is None:
             utc_now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -354,6 +473,7 @@ class DatabaseManager:
             streams_coll = self.db.streams
             streams_coll.insert_one(metadata)
 
+    @_invalidates_query_cache
     def update_stream_metadata(self, name, metadata):
         streams_coll = self.db.streams
         if "hsc.bin" in name:
@@ -366,6 +486,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         streams_coll.update_one(query, set_value, upsert=True)
 
+    @_invalidates_query_cache
     def insert_stream_log_entry(self, name, entry):
         entry["extended_build_num"] = self.config["extended_build_num"]
         streams_coll = self.db.streams
@@ -383,6 +504,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         streams_coll.update_one(query, set_value, upsert=True)
 
+    @_cached_query
     def find_data_collection_by_id(self, dcid):
         data_collections_coll = self.db.data_collections
         return data_collections_coll.find_one({"dcid": dcid, "build_num": self.config["build_num"]})
@@ -395,6 +517,7 @@ class DatabaseManager:
         }
         return list(data_collections_coll.find(query).sort(field, sort))
 
+    @_invalidates_query_cache
     def delete_data_collections_touching_date_range(self, field, start, stop, sort=1):
         data_collections_coll = self.db.data_collections
         query = {
@@ -407,6 +530,7 @@ class DatabaseManager:
         data_collections_coll.delete_many(query)
         return data_collections
 
+    @_cached_query
     def find_data_collections_by_orbit_id(self, orbit_id, submode="science"):
         data_collections_coll = self.db.data_collections
         return list(data_collections_coll.find({
@@ -427,11 +551,19 @@ class DatabaseManager:
             "associated_acquisitions": {"$exists": 0},
             "build_num": self.config["build_num"]
         }
-        results = list(data_collections_coll.find(query))
+        # Only return the fields needed to create reassembly tasks and check their outputs
+        projection = {
+            "dcid": 1,
+            "processing_log.task": 1,
+            "processing_log.completion_status": 1,
+            "processing_log.output": 1
+        }
+        results = list(data_collections_coll.find(query, projection))
         if not retry_failed:
             results = self._remove_results_with_failed_tasks(results, ["emit.L1AReassembleRaw", "emit.L1AFrameReport"])
         return results
 
+    @_invalidates_query_cache
     def insert_data_collection(self, metadata):
         if self.find_data_collection_by_id(metadata["dcid"]) is None:
             utc_now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -440,6 +572,7 @@ class DatabaseManager:
             data_collections_coll = self.db.data_collections
             data_collections_coll.insert_one(metadata)
 
+    @_invalidates_query_cache
     def update_data_collection_metadata(self, dcid, metadata):
         data_collections_coll = self.db.data_collections
         query = {"dcid": dcid, "build_num": self.config["build_num"]}
@@ -447,6 +580,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         data_collections_coll.update_one(query, set_value, upsert=True)
 
+    @_invalidates_query_cache
     def insert_data_collection_log_entry(self, dcid, entry):
         entry["extended_build_num"] = self.config["extended_build_num"]
         data_collections_coll = self.db.data_collections
@@ -459,6 +593,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         data_collections_coll.update_one(query, set_value, upsert=True)
 
+    @_cached_query
     def find_orbit_by_id(self, orbit_id):
         orbits_coll = self.db.orbits
         return orbits_coll.find_one({"orbit_id": orbit_id, "build_num": self.config["build_num"]})
@@ -471,6 +606,7 @@ class DatabaseManager:
         }
         return list(orbits_coll.find(query).sort(field, sort))
 
+    @_invalidates_query_cache
     def delete_orbits_touching_date_range(self, field, start, stop, sort=1):
         orbits_coll = self.db.orbits
         query = {
@@ -551,6 +687,7 @@ class DatabaseManager:
             results = self._remove_results_with_failed_tasks(results, ["emit.L1BAttDeliver"])
         return results
 
+    @_invalidates_query_cache
     def insert_orbit(self, metadata):
         if self.find_orbit_by_id(metadata["orbit_id"]) is None:
             utc_now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -559,6 +696,7 @@ class DatabaseManager:
             orbits_coll = self.db.orbits
             orbits_coll.insert_one(metadata)
 
+    @_invalidates_query_cache
     def update_orbit_metadata(self, orbit_id, metadata):
         orbits_coll = self.db.orbits
         query = {"orbit_id": orbit_id, "build_num": self.config["build_num"]}
@@ -566,6 +704,7 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         orbits_coll.update_one(query, set_value, upsert=True)
 
+    @_invalidates_query_cache
     def insert_orbit_log_entry(self, orbit_id, entry):
         entry["extended_build_num"] = self.config["extended_build_num"]
         orbits_coll = self.db.orbits
@@ -578,14 +717,17 @@ class DatabaseManager:
         set_value = {"$set": metadata}
         orbits_coll.update_one(query, set_value, upsert=True)
 
+    @_cached_query
     def find_granule_report_by_id(self, submission_id):
         granule_reports_coll = self.db.granule_reports
         return granule_reports_coll.find_one({"submission_id": submission_id})
 
+    @_invalidates_query_cache
     def insert_granule_report(self, report):
         granule_reports_coll = self.db.granule_reports
         granule_reports_coll.insert_one(report)
 
+    @_invalidates_query_cache
     def update_granule_report_submission_statuses(self, submission_id, status):
         granule_reports_coll = self.db.granule_reports
         query = {"submission_id": submission_id}
@@ -626,6 +768,7 @@ class DatabaseManager:
         results = list(granule_reports_coll.find(query))
         return results
 
+    @_invalidates_query_cache
     def update_reconciliation_submission_status(self, daac_filename, submission_id, report, status):
         granule_reports_coll = self.db.granule_reports
         query = {
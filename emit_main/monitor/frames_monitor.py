@@ -47,12 +47,18 @@ class FramesMonitor:
 
         for dc in data_collections:
             logger.info(f"Creating L1AFrameReport task for dcid {dc['dcid']}")
+            # Pass along the processing log from the query above so that the tasks don't need to look it up again
+            processing_log = []
+            if "processing_log" in dc:
+                processing_log = [log for log in dc["processing_log"]
+                                  if log["task"] in ("emit.L1AReassembleRaw", "emit.L1AFrameReport")]
             tasks.append(L1AFrameReport(config_path=self.config_path,
                                         dcid=dc["dcid"],
                                         level=self.level,
                                         partition=self.partition,
                                         ignore_missing_frames=self.ignore_missing_frames,
                                         acq_chunksize=self.acq_chunksize,
-                                        test_mode=self.test_mode))
+                                        test_mode=self.test_mode,
+                                        prefetched_processing_log=processing_log))
 
         return tasks
@@ -7,7 +7,8 @@ Author: Winston Olson-Duvall, winston.olson-duvall@jpl.nasa.gov
 import datetime
 import os
 
-from emit_main.database.database_manager import DatabaseManager
+from emit_main.database import database_manager
+from emit_main.database.database_manager import DatabaseManager, _cached_query, _invalidates_query_cache
 
 
 def test_acquisition_delete(config_path):
@@ -117,3 +118,88 @@ def test_stream_update(config_path):
     stream = dm.find_stream_by_name(hosc_name)
 
     assert stream["hosc_name"] == hosc_name and stream["test_key"] == "test_value"
+
+
+class FakeDatabaseManager:
+    """Counts lookups made through the query cache without needing a DB"""
+
+    config = {"db_name": "test", "build_num": "0000"}
+
+    def __init__(self, during_lookup=None):
+        self.lookups = 0
+        self.during_lookup = during_lookup
+
+    @_cached_query
+    def find_thing_by_id(self, thing_id):
+        self.lookups += 1
+        if self.during_lookup is not None:
+            self.during_lookup()
+        return {"thing_id": thing_id, "lookup": self.lookups}
+
+    @_invalidates_query_cache
+    def update_thing(self, thing_id):
+        pass
+
+
+def test_query_cache_ttl(monkeypatch):
+
+    print("\nRunning test_query_cache_ttl")
+
+    database_manager._clear_query_cache()
+    now = [1000.0]
+    monkeypatch.setattr(database_manager.time, "monotonic", lambda: now[0])
+    dm = FakeDatabaseManager()
+
+    first = dm.find_thing_by_id("a")
+    first["modified"] = True
+    second = dm.find_thing_by_id("a")
+    assert dm.lookups == 1 and second == {"thing_id": "a", "lookup": 1}
+
+    now[0] += database_manager._QUERY_CACHE_TTL + 1
+    dm.find_thing_by_id("a")
+    assert dm.lookups == 2
+
+
+def test_query_cache_invalidation():
+
+    print("\nRunning test_query_cache_invalidation")
+
+    database_manager._clear_query_cache()
+    dm = FakeDatabaseManager()
+
+    dm.find_thing_by_id("a")
+    dm.update_thing("a")
+    dm.find_thing_by_id("a")
+    assert dm.lookups == 2
+
+    dm.find_thing_by_id("a")
+    database_manager._clear_query_cache()
+    dm.find_thing_by_id("a")
+    assert dm.lookups == 3
+
+
+def test_query_cache_write_during_lookup():
+
+    print("\nRunning test_query_cache_write_during_lookup")
+
+    database_manager._clear_query_cache()
+    # Simulate another thread writing while the first lookup is running, which must not leave a stale entry
+    dm = FakeDatabaseManager(during_lookup=database_manager._clear_query_cache)
+
+    dm.find_thing_by_id("a")
+    dm.during_lookup = None
+    dm.find_thing_by_id("a")
+    assert dm.lookups == 2
+
+
+def test_query_cache_fork_reset(monkeypatch):
+
+    print("\nRunning test_query_cache_fork_reset")
+
+    database_manager._clear_query_cache()
+    dm = FakeDatabaseManager()
+
+    dm.find_thing_by_id("a")
+    monkeypatch.setattr(database_manager.os, "getpid", lambda: -1)
+    dm.find_thing_by_id("a")
+    assert dm.lookups == 2
@@ -0,0 +1,121 @@
+"""
+This code contains test functions for slurm.py
+"""
+
+import subprocess
+
+from emit_main.workflow import slurm
+
+
+class FakeSqueue:
+    """Stands in for subprocess.run, answering squeue calls from a dictionary of job states"""
+
+    def __init__(self, states):
+        self.states = states
+        self.calls = []
+
+    def __call__(self, cmd, **kwargs):
+        job_ids = [int(job_id) for job_id in cmd[cmd.index("-j") + 1].split(",")]
+        self.calls.append(job_ids)
+        if any(job_id not in self.states for job_id in job_ids):
+            return subprocess.CompletedProcess(cmd, 1, stdout=b"",
+                                               stderr=b"slurm_load_jobs error: Invalid job id specified\n")
+        stdout = "".join(f"{job_id} {self.states[job_id]}\n" for job_id in job_ids)
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout.encode("utf-8"), stderr=b"")
+
+
+def _make_poller(min_interval=0.2, max_interval=10):
+    poller = slurm._SqueuePoller()
+    poller.min_interval = min_interval
+    poller.max_interval = max_interval
+    poller._interval = min_interval
+    return poller
+
+
+def test_parse_squeue_states():
+
+    print("\nRunning test_parse_squeue_states")
+
+    out = "101 R\n102 PD\n\n999 R\nnot-a-job\n"
+    states = slurm._parse_squeue_states(out, [101, 102, 103])
+    assert states == {101: "R", 102: "PD", 103: "u"}
+
+
+def test_squeue_poller_batches_jobs(monkeypatch):
+
+    print("\nRunning test_squeue_poller_batches_jobs")
+
+    fake = FakeSqueue({1: "R", 2: "PD", 3: "R"})
+    monkeypatch.setattr(slurm.subprocess, "run", fake)
+    poller = _make_poller()
+
+    events = [poller.register(job_id) for job_id in (1, 2, 3)]
+    for event in events:
+        assert event.wait(5)
+
+    assert fake.calls[0] == [1, 2, 3]
+    assert [poller.get_state(job_id) for job_id in (1, 2, 3)] == ["R", "PD", "R"]
+
+    for job_id in (1, 2, 3):
+        poller.unregister(job_id)
+
+
+def test_squeue_poller_backoff_resets_on_register(monkeypatch):
+
+    print("\nRunning test_squeue_poller_backoff_resets_on_register")
+
+    fake = FakeSqueue({1: "R", 2: "R"})
+    monkeypatch.setattr(slurm.subprocess, "run", fake)
+    poller = _make_poller(min_interval=0.05)
+
+    # Let the interval back off to well over a second
+    event = poller.register(1)
+    for i in range(5):
+        assert event.wait(5)
+        event.clear()
+    assert poller._interval >= 1
+
+    event = poller.register(2)
+    assert poller._interval == poller.min_interval
+    assert event.wait(0.5)
+    # Both jobs are queried in the same call once the second one is registered
+    assert fake.calls[-1] == [1, 2]
+
+    poller.unregister(1)
+    poller.unregister(2)
+
+
+def test_squeue_poller_finished_job(monkeypatch):
+
+    print("\nRunning test_squeue_poller_finished_job")
+
+    # Job 2 has left the queue, so squeue rejects the batched call and each job is queried on its own
+    fake = FakeSqueue({1: "R"})
+    monkeypatch.setattr(slurm.subprocess, "run", fake)
+    poller = _make_poller()
+
+    events = [poller.register(job_id) for job_id in (1, 2)]
+    for event in events:
+        assert event.wait(5)
+
+    assert fake.calls[:3] == [[1, 2], [1], [2]]
+    assert poller.get_state(1) == "R"
+    assert poller.get_state(2) == "u"
+
+    poller.unregister(1)
+    poller.unregister(2)
+
+
+def test_get_sbatch_errors(tmp_path):
+
+    print("\nRunning test_get_sbatch_errors")
+
+    errfile = tmp_path / "job.err"
+    # A job that never started has no error file, which must not count as success
+    assert slurm._get_sbatch_errors(str(errfile)) != ""
+
+    errfile.write_text("")
+    assert slurm._get_sbatch_errors(str(errfile)) == ""
+
+    errfile.write_text("Traceback: failed\n")
+    assert slurm._get_sbatch_errors(str(errfile)) == "Traceback: failed\n"
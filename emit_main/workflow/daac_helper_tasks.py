@@ -4,6 +4,7 @@ This code contains tasks pertaining DAAC delivery
 Author: Winston Olson-Duvall, winston.olson-duvall@jpl.nasa.gov
 """
 
+import concurrent.futures
 import datetime
 import glob
 import json
@@ -13,7 +14,6 @@ import os
 
 from emit_main.workflow.output_targets import DAACSceneNumbersTarget
 from emit_main.workflow.slurm import SlurmJobTask
-from emit_main.workflow.workflow_manager import WorkflowManager
 from emit_utils.file_checks import get_gring_boundary_points, get_band_mean
 
 logger = logging.getLogger("emit-main")
@@ -34,6 +34,24 @@ class AssignDAACSceneNumbers(SlurmJobTask):
 
     task_namespace = "emit"
 
+    # Acquisitions in the orbit keyed by (orbit_id, submode), shared between output() and work() when they run in the
+    # same process. The pid is stored with them so that a forked worker or the compute node looks them up again rather
+    # than using the ones from when the scheduler checked the task.
+    _acquisitions_cache = None
+    _process_local_attrs = SlurmJobTask._process_local_attrs + ("_acquisitions_cache",)
+
+    def _get_orbit_acquisitions(self, dm, orbit_id):
+        if self._acquisitions_cache is None or self._acquisitions_cache[0] != os.getpid():
+            self._acquisitions_cache = (os.getpid(), {})
+        cache = self._acquisitions_cache[1]
+        acquisitions = []
+        for submode in ("science", "dark"):
+            key = (orbit_id, submode)
+            if key not in cache:
+                cache[key] = dm.find_acquisitions_by_orbit_id(orbit_id, submode, min_valid_lines=0)
+            acquisitions += cache[key]
+        return acquisitions
+
     def requires(self):
 
         logger.debug(f"{self.task_family} requires: {self.orbit_id}")
@@ -46,20 +64,19 @@ class AssignDAACSceneNumbers(SlurmJobTask):
         if self.override_output:
             return None
 
-        wm = WorkflowManager(config_path=self.config_path, orbit_id=self.orbit_id)
+        wm = self.wm
         orbit = wm.orbit
         dm = wm.database_manager
 
-        # Get acquisitions in orbit
-        acquisitions = dm.find_acquisitions_by_orbit_id(orbit.orbit_id, "science", min_valid_lines=0)
-        acquisitions += dm.find_acquisitions_by_orbit_id(orbit.orbit_id, "dark", min_valid_lines=0)
-        return DAACSceneNumbersTarget(acquisitions)
+        # Only get acquisitions in orbit if the marker file from a previous run is missing
+        return DAACSceneNumbersTarget(lambda: self._get_orbit_acquisitions(dm, orbit.orbit_id),
+                                      marker_path=orbit.daac_scenes_marker_path)
 
     def work(self):
 
         logger.debug(f"{self.task_family} work: {self.acquisition_id}")
 
-        wm = WorkflowManager(config_path=self.config_path, orbit_id=self.orbit_id)
+        wm = self.wm
         orbit = wm.orbit
         pge = wm.pges["emit-main"]
         dm = wm.database_manager
@@ -69,53 +86,23 @@ class AssignDAACSceneNumbers(SlurmJobTask):
                                f"--override_output if you want to continue to assign daac scene numbers.")
 
         # Get acquisitions in orbit
-        acquisitions = dm.find_acquisitions_by_orbit_id(orbit.orbit_id, "science", min_valid_lines=0)
-        acquisitions += dm.find_acquisitions_by_orbit_id(orbit.orbit_id, "dark", min_valid_lines=0)
+        acquisitions = self._get_orbit_acquisitions(dm, orbit.orbit_id)
 
         # Throw error if some acquisitions have daac scene numbers but others don't
         count = 0
-        acq_ids = []
+        acq_ids = set()
         for acq in acquisitions:
             if "daac_scene" in acq:
                 count += 1
-            acq_ids.append(acq["acquisition_id"])
+            acq_ids.add(acq["acquisition_id"])
 
         if not self.override_output and 0 < count < len(acquisitions):
             raise RuntimeError(f"While assigning scene numbers for DAAC, found some with scene numbers already. "
                                f"Aborting...")
 
-        # Assign the scene numbers
-        acq_ids = list(set(acq_ids))
-        acq_ids.sort()
-        daac_scene = 1
-        for acq_id in acq_ids:
-            dm.update_acquisition_metadata(acq_id, {"daac_scene": str(daac_scene).zfill(3)})
-
-            log_entry = {
-                "task": self.task_family,
-                "pge_name": pge.repo_url,
-                "pge_version": pge.version_tag,
-                "pge_input_files": {
-                    "orbit_id": orbit.orbit_id
-                },
-                "pge_run_command": "N/A - DB updates only",
-                "documentation_version": "N/A",
-                "log_timestamp": datetime.datetime.now(tz=datetime.timezone.utc),
-                "completion_status": "SUCCESS",
-                "output": {
-                    "daac_scene_number": str(daac_scene).zfill(3)
-                }
-            }
-
-            dm.insert_acquisition_log_entry(acq_id, log_entry)
-
-            # Increment scene number
-            daac_scene += 1
-
-        # Update orbit metadata and processing log too
-        num_scenes = len(acq_ids)
-        dm.update_orbit_metadata(orbit.orbit_id, {"num_scenes": num_scenes})
-        log_entry = {
+        # Assign the scene numbers, batching the DB writes so that they are submitted after the loop. All of the log
+        # entries share the same fields other than the output.
+        base_log_entry = {
             "task": self.task_family,
             "pge_name": pge.repo_url,
             "pge_version": pge.version_tag,
@@ -125,14 +112,35 @@ class AssignDAACSceneNumbers(SlurmJobTask):
             "pge_run_command": "N/A - DB updates only",
             "documentation_version": "N/A",
             "log_timestamp": datetime.datetime.now(tz=datetime.timezone.utc),
-            "completion_status": "SUCCESS",
-            "output": {
-                "number_of_scenes": num_scenes
-            }
+            "completion_status": "SUCCESS"
         }
+        updates = []
+        daac_scene = 1
+        for acq_id in sorted(acq_ids):
+            daac_scene_str = f"{daac_scene:03d}"
+            log_entry = {**base_log_entry, "output": {"daac_scene_number": daac_scene_str}}
+            updates.append((acq_id, {"daac_scene": daac_scene_str}, log_entry))
+
+            # Increment scene number
+            daac_scene += 1
+
+        dm.bulk_update_acquisitions(updates)
+
+        # The cached acquisitions no longer reflect the DB
+        self._acquisitions_cache = None
+
+        # Update orbit metadata and processing log too
+        num_scenes = len(acq_ids)
+        dm.update_orbit_metadata(orbit.orbit_id, {"num_scenes": num_scenes})
+        log_entry = {**base_log_entry, "output": {"number_of_scenes": num_scenes}}
 
         dm.insert_orbit_log_entry(self.orbit_id, log_entry)
 
+        # Write marker file so that later output checks can skip the DB
+        with open(orbit.daac_scenes_marker_path, "w"):
+            pass
+        wm.change_group_ownership(orbit.daac_scenes_marker_path)
+
 
 class GetAdditionalMetadata(SlurmJobTask):
     """
@@ -162,19 +170,20 @@ class GetAdditionalMetadata(SlurmJobTask):
 
         logger.debug(f"{self.task_family} work: {self.acquisition_id}")
 
-        wm = WorkflowManager(config_path=self.config_path, acquisition_id=self.acquisition_id)
+        wm = self.wm
         acq = wm.acquisition
         pge = wm.pges["emit-main"]
         dm = wm.database_manager
 
-        # Get additional attributes and add to DB
-        glt_gring = get_gring_boundary_points(acq.glt_hdr_path)
-        mean_solar_azimuth = get_band_mean(acq.obs_img_path, 3)
-        mean_solar_zenith = get_band_mean(acq.obs_img_path, 4)
+        # Get additional attributes and add to DB. These are independent file reads, so overlap them.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            glt_gring = executor.submit(get_gring_boundary_points, acq.glt_hdr_path)
+            mean_solar_azimuth = executor.submit(get_band_mean, acq.obs_img_path, 3)
+            mean_solar_zenith = executor.submit(get_band_mean, acq.obs_img_path, 4)
         meta = {
-            "gring": glt_gring,
-            "mean_solar_azimuth": mean_solar_azimuth,
-            "mean_solar_zenith": mean_solar_zenith
+            "gring": glt_gring.result(),
+            "mean_solar_azimuth": mean_solar_azimuth.result(),
+            "mean_solar_zenith": mean_solar_zenith.result()
         }
         dm.update_acquisition_metadata(acq.acquisition_id, meta)
 
@@ -226,7 +235,7 @@ class ReconciliationReport(SlurmJobTask):
 
         logger.debug(f"{self.task_family} work: {self.start_time} to {self.stop_time}")
 
-        wm = WorkflowManager(config_path=self.config_path)
+        wm = self.wm
         pge = wm.pges["emit-main"]
         dm = wm.database_manager
 
@@ -285,6 +285,9 @@ class L1AReassembleRaw(SlurmJobTask):
     partition = luigi.Parameter()
     acq_chunksize = luigi.IntParameter(default=1280)
     test_mode = luigi.BoolParameter(default=False)
+    # Processing log entries fetched by the frames monitor so that output() can skip its own DB lookup
+    prefetched_processing_log = luigi.ListParameter(default=None, significant=False)
+    _prefetched_processing_log_used = False
 
     memory = 90000
 
@@ -299,6 +302,12 @@ class L1AReassembleRaw(SlurmJobTask):
     def output(self):
 
         logger.debug(f"{self.task_family} output: {self.dcid}")
+        # Only use the prefetched log for the first check. Luigi checks again just before running dependent tasks
+        # and by then the log may be out of date.
+        if self.prefetched_processing_log is not None and not self._prefetched_processing_log_used:
+            self._prefetched_processing_log_used = True
+            return DataCollectionTarget(data_collection=None, task_family=self.task_family,
+                                        processing_log=self.prefetched_processing_log)
         wm = WorkflowManager(config_path=self.config_path, dcid=self.dcid)
         return DataCollectionTarget(data_collection=wm.data_collection, task_family=self.task_family)
 
@@ -677,6 +686,9 @@ class L1AFrameReport(SlurmJobTask):
     partition = luigi.Parameter()
     acq_chunksize = luigi.IntParameter(default=1280)
     test_mode = luigi.BoolParameter(default=False)
+    # Processing log entries fetched by the frames monitor so that output() can skip its own DB lookup
+    prefetched_processing_log = luigi.ListParameter(default=None, significant=False)
+    _prefetched_processing_log_used = False
 
     memory = 90000
 
@@ -687,11 +699,18 @@ class L1AFrameReport(SlurmJobTask):
         logger.debug(f"{self.task_family} requires: {self.dcid}")
         return L1AReassembleRaw(config_path=self.config_path, dcid=self.dcid, level=self.level,
                                 partition=self.partition, ignore_missing_frames=self.ignore_missing_frames,
-                                acq_chunksize=self.acq_chunksize, test_mode=self.test_mode)
+                                acq_chunksize=self.acq_chunksize, test_mode=self.test_mode,
+                                prefetched_processing_log=self.prefetched_processing_log)
 
     def output(self):
 
         logger.debug(f"{self.task_family} output: {self.dcid}")
+        # Only use the prefetched log for the first check. Luigi checks again just before running dependent tasks
+        # and by then the log may be out of date.
+        if self.prefetched_processing_log is not None and not self._prefetched_processing_log_used:
+            self._prefetched_processing_log_used = True
+            return DataCollectionTarget(data_collection=None, task_family=self.task_family,
+                                        processing_log=self.prefetched_processing_log)
         wm = WorkflowManager(config_path=self.config_path, dcid=self.dcid)
         return DataCollectionTarget(data_collection=wm.data_collection, task_family=self.task_family)
 
@@ -86,12 +86,14 @@ class L2BAbundance(SlurmJobTask):
         cmd_tetra_setup = [os.path.join(wm.config["tetracorder_cmds_path"], 'cmd-setup-tetrun'), tmp_tetra_output_path,
                            wm.config["tetracorder_library_cmdname"], "cube", tmp_rfl_path, "1", "-T", "-20", "80", "C",
                            "-P", ".5", "1.5", "bar"]
-        pge.run(cmd_tetra_setup, tmp_dir=self.tmp_dir, env=env)
+        # Tetracorder writes a lot of output, so send it to a log file rather than holding it in memory
+        tmp_tetra_log_path = os.path.join(self.local_tmp_dir, "tetracorder.log")
+        pge.run(cmd_tetra_setup, tmp_dir=self.tmp_dir, env=env, log_path=tmp_tetra_log_path)
 
         current_pwd = os.getcwd()
         os.chdir(tmp_tetra_output_path)
         cmd_tetra = [os.path.join(tmp_tetra_output_path, "cmd.runtet"), "cube", tmp_rfl_path, 'band', '20', 'gif']
-        pge.run(cmd_tetra, tmp_dir=self.tmp_dir, env=env)
+        pge.run(cmd_tetra, tmp_dir=self.tmp_dir, env=env, log_path=tmp_tetra_log_path)
         os.chdir(current_pwd)
 
         # Build aggregator cmd
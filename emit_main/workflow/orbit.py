@@ -57,6 +57,9 @@ class Orbit:
                                  f"v{self.config['processing_version']}.nc"])
         self.uncorr_att_eph_path = os.path.join(self.l1a_dir, uncorr_fname)
         self.corr_att_eph_path = self.uncorr_att_eph_path.replace("l1a", "l1b")
+        # Marker file written once DAAC scene numbers have been assigned to the orbit's acquisitions
+        self.daac_scenes_marker_path = os.path.join(
+            self.orbit_id_dir, f"o{self.orbit_id}_daac_scenes_b{self.config['build_num']}.done")
 
         # Make directories and symlinks if they don't exist
         from emit_main.workflow.workflow_manager import WorkflowManager
@@ -14,18 +14,24 @@ logger = logging.getLogger("emit-main")
 
 
 class DataCollectionTarget(luigi.Target):
-    def __init__(self, data_collection, task_family):
+    def __init__(self, data_collection, task_family, processing_log=None):
         self._dc = data_collection
         self._task_family = task_family
+        # Optionally use a processing log that was already fetched from the DB instead of the data collection's
+        self._processing_log = processing_log
 
     def exists(self):
-        if self._dc is None:
+        if self._processing_log is not None:
+            processing_log = self._processing_log
+        elif self._dc is None:
             return False
-        for log in reversed(self._dc.processing_log):
+        else:
+            processing_log = self._dc.processing_log
+        for log in reversed(processing_log):
             if log["task"] == self._task_family and log["completion_status"] == "SUCCESS":
                 # Check that outputs exist on filesystem
                 for val in log["output"].values():
-                    if type(val) == list:
+                    if isinstance(val, (list, tuple)):
                         for v in val:
                             if not os.path.exists(v):
                                 return False
@@ -60,11 +66,15 @@ class OrbitTarget(luigi.Target):
 
 
 class DAACSceneNumbersTarget(luigi.Target):
-    def __init__(self, acquisitions):
-        self._acquisitions = acquisitions
+    """This class checks for a marker file first and only looks up the orbit's acquisitions if it is missing"""
+    def __init__(self, get_acquisitions, marker_path=None):
+        self._get_acquisitions = get_acquisitions
+        self._marker_path = marker_path
 
     def exists(self):
-        for acq in self._acquisitions:
+        if self._marker_path is not None and os.path.exists(self._marker_path):
+            return True
+        for acq in self._get_acquisitions():
             if "daac_scene" not in acq:
                 logger.debug(f"Failed to find DAAC scene number for {acq['acquisition_id']}")
                 return False
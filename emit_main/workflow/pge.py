@@ -4,12 +4,17 @@ pge.py includes the PGE class that handles looking up and checking out code and
 Author: Winston Olson-Duvall, winston.olson-duvall@jpl.nasa.gov
 """
 
+import collections
 import logging
 import os
 import subprocess
 
 logger = logging.getLogger("emit-main")
 
+# Changes to the environment made by activating each conda env, keyed by (conda_exe, conda_env_name). These are looked up
+# once per process so that PGE.run doesn't need to go through "conda run" for every command.
+_ACTIVATED_ENV_VARS = {}
+
 
 class PGE:
 
@@ -54,21 +59,24 @@ class PGE:
     def _clone_repo(self):
         cmd = ["git", "clone", self.repo_url, self.repo_dir]
         logger.info("Cloning repo with cmd: %s" % " ".join(cmd))
-        output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
+        output = subprocess.run(cmd, capture_output=True)
         if output.returncode != 0:
             raise RuntimeError("Failed to clone repo with cmd: %s" % str(cmd))
 
     def _git_pull(self):
-        cmd = ["cd", self.repo_dir, "&&", "git", "pull"]
-        logger.info("Pulling code with cmd: %s" % " ".join(cmd))
-        output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
+        cmd = ["git", "pull"]
+        logger.info("Pulling code in %s with cmd: %s" % (self.repo_dir, " ".join(cmd)))
+        output = subprocess.run(cmd, cwd=self.repo_dir, capture_output=True)
         if output.returncode != 0:
             raise RuntimeError("Failed to pull code with cmd: %s" % str(cmd))
 
     def _repo_tag_needs_update(self):
-        cmd = ["cd", self.repo_dir, "&&", "git", "symbolic-ref", "-q", "--short", "HEAD", "||",
-               "git", "describe", "--tags", "--exact-match"]
-        output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
+        # Get the current branch, or the tag if HEAD is detached
+        cmd = ["git", "symbolic-ref", "-q", "--short", "HEAD"]
+        output = subprocess.run(cmd, cwd=self.repo_dir, capture_output=True)
+        if output.returncode != 0:
+            cmd = ["git", "describe", "--tags", "--exact-match"]
+            output = subprocess.run(cmd, cwd=self.repo_dir, capture_output=True)
         if output.returncode != 0:
             logger.error("Failed to get current version tag or branch with cmd: %s" % str(cmd))
             raise RuntimeError(output.stderr.decode("utf-8"))
@@ -76,27 +84,23 @@ class PGE:
         return True if current_tag != self.version_tag else False
 
     def _checkout_tag(self):
-        cmd = ["cd", self.repo_dir, "&&", "git", "fetch", "--all", "&&", "git", "checkout", self.version_tag]
-        logger.info("Checking out version tag or branch with cmd: %s" % " ".join(cmd))
-        output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
-        if output.returncode != 0:
-            logger.error("Failed to checkout version tag or branch with cmd: %s" % str(cmd))
-            raise RuntimeError(output.stderr.decode("utf-8"))
+        for cmd in (["git", "fetch", "--all"], ["git", "checkout", self.version_tag]):
+            logger.info("Checking out version tag or branch in %s with cmd: %s" % (self.repo_dir, " ".join(cmd)))
+            output = subprocess.run(cmd, cwd=self.repo_dir, capture_output=True)
+            if output.returncode != 0:
+                logger.error("Failed to checkout version tag or branch with cmd: %s" % str(cmd))
+                raise RuntimeError(output.stderr.decode("utf-8"))
 
     def _conda_env_exists(self):
-        cmd = [self.conda_exe, "env", "list", "|", "grep", self.conda_env_dir]
-        output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
-        if output.returncode == 0:
-            return True
-        else:
-            return False
+        # A conda env is a directory with a conda-meta folder, so there's no need to ask conda for its env list
+        return os.path.isdir(os.path.join(self.conda_env_dir, "conda-meta"))
 
     def _create_conda_env(self):
         conda_env_yml_path = os.path.join(self.repo_dir, "environment.yml")
         if os.path.exists(conda_env_yml_path):
             cmd = [self.conda_exe, "env", "create", "-f", conda_env_yml_path, "-n", self.conda_env_name]
             logger.info("Creating conda env with cmd: %s" % " ".join(cmd))
-            output = subprocess.run(" ".join(cmd), shell=True, capture_output=True)
+            output = subprocess.run(cmd, capture_output=True)
             if output.returncode != 0:
                 raise RuntimeError("Failed to create conda env with cmd: %s" % str(cmd))
 
@@ -173,19 +177,63 @@ class PGE:
             #    subprocess.run(rm_conda_env_cmd)
             print(e)
 
-    def run(self, cmd, cwd=None, tmp_dir=None, env=None, use_conda_run=True):
-        cwd_args = []
-        if cwd:
-            cwd_args = ["--cwd", cwd]
+    def _conda_env_flag(self):
+        return "-p" if self.conda_env_name.startswith("/") else "-n"
+
+    def _get_activated_env_vars(self):
+        """Returns the changes that activating the conda env makes to this process's environment as a tuple of
+        (variables set, entries added to and removed from PATH-like variables, variables unset)"""
+        key = (self.conda_exe, self.conda_env_name)
+        if key not in _ACTIVATED_ENV_VARS:
+            cmd = [self.conda_exe, "run", self._conda_env_flag(), self.conda_env_name, "env", "-0"]
+            output = subprocess.run(cmd, capture_output=True)
+            if output.returncode != 0:
+                logger.error("Failed to get activated environment with cmd: %s" % " ".join(cmd))
+                raise RuntimeError(output.stderr.decode("utf-8"))
+            activated = {}
+            for item in output.stdout.decode("utf-8").split("\0"):
+                name, sep, value = item.partition("=")
+                if sep:
+                    activated[name] = value
+            set_vars = {}
+            path_vars = {}
+            for name, value in activated.items():
+                if os.environ.get(name) == value:
+                    continue
+                if name.endswith("PATH") and name in os.environ:
+                    # Keep track of the entries activation adds and removes so they can be applied to the caller's
+                    # value, as "conda run" would
+                    old_entries = os.environ[name].split(os.pathsep)
+                    new_entries = value.split(os.pathsep)
+                    path_vars[name] = ([e for e in new_entries if e not in old_entries],
+                                       [e for e in old_entries if e not in new_entries])
+                else:
+                    set_vars[name] = value
+            unset_vars = {name for name in os.environ if name not in activated}
+            _ACTIVATED_ENV_VARS[key] = (set_vars, path_vars, unset_vars)
+        return _ACTIVATED_ENV_VARS[key]
+
+    def _activate_env(self, env):
+        """Returns a copy of env with the changes from activating the conda env applied to it"""
+        set_vars, path_vars, unset_vars = self._get_activated_env_vars()
+        env = {name: value for name, value in env.items() if name not in unset_vars}
+        env.update(set_vars)
+        for name, (added, removed) in path_vars.items():
+            entries = [e for e in env.get(name, "").split(os.pathsep) if e and e not in removed]
+            env[name] = os.pathsep.join(added + [e for e in entries if e not in added])
+        return env
+
+    def run(self, cmd, cwd=None, tmp_dir=None, env=None, use_conda_run=True, log_path=None):
         if env is None:
             env = os.environ.copy()
         if use_conda_run is False:
             run_cmd = " ".join(cmd)
-        elif self.conda_env_name.startswith("/"):
-            run_cmd = " ".join([self.conda_exe, "run", "-p", self.conda_env_name] + cwd_args + cmd)
         else:
-            # Otherwise, use conda run syntax
-            run_cmd = " ".join([self.conda_exe, "run", "-n", self.conda_env_name] + cwd_args + cmd)
+            # Run the command in the conda env's activated environment rather than via "conda run". The equivalent
+            # "conda run" command is still what gets logged so that it can be rerun by hand.
+            cwd_args = ["--cwd", cwd] if cwd else []
+            run_cmd = " ".join([self.conda_exe, "run", self._conda_env_flag(), self.conda_env_name] + cwd_args + cmd)
+            env = self._activate_env(env)
         logger.info("Running command: %s" % run_cmd)
         if tmp_dir is not None:
             with open(os.path.join(tmp_dir, "cmd.txt"), "a") as f:
@@ -193,7 +241,20 @@ class PGE:
                 f.write(run_cmd + "\n\n")
                 f.write("Command (using \"error\" directory):\n")
                 f.write(run_cmd.replace("/tmp/", "/error/") + "\n\n")
-        output = subprocess.run(run_cmd, shell=True, capture_output=True, env=env)
+        # Commands may contain shell redirection, so they still run through the shell. Nothing reads the command's
+        # stdout, so don't hold it in memory. If a log path is given, send both stdout and stderr there instead.
+        run_cwd = cwd if use_conda_run else None
+        if log_path is None:
+            output = subprocess.run(" ".join(cmd), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    env=env, cwd=run_cwd)
+        else:
+            with open(log_path, "a") as f:
+                output = subprocess.run(" ".join(cmd), shell=True, stdout=f, stderr=subprocess.STDOUT, env=env,
+                                        cwd=run_cwd)
         if output.returncode != 0:
-            logger.error("PGE %s run command failed: %s" % (self.repo_name, output.args))
-            raise RuntimeError(output.stderr.decode("utf-8"))
+            logger.error("PGE %s run command failed: %s" % (self.repo_name, run_cmd))
+            if log_path is None:
+                raise RuntimeError(output.stderr.decode("utf-8"))
+            # Report the end of the log, which is where the error will be
+            with open(log_path, "r", errors="replace") as f:
+                raise RuntimeError("".join(collections.deque(f, 200)))
@@ -1,10 +1,11 @@
 import datetime
+import gzip
 import logging
 import os
 import pickle
 import subprocess
+import threading
 import time
-import random
 
 import luigi
 
@@ -12,12 +13,19 @@ from emit_main.workflow.workflow_manager import WorkflowManager
 
 logger = logging.getLogger("emit-main")
 
+# Final job states reported by `sacct` that mean the job did not finish successfully
+SLURM_FAILURE_STATES = ("BOOT_FAIL", "CANCELLED", "DEADLINE", "FAILED", "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED",
+                        "TIMEOUT")
 
-def _build_sbatch_script(tmp_dir, cmd, job_name, partition, outfile, errfile, n_nodes, n_tasks, n_cores, memory,
+# Characters to remove or replace when using a task instance id as a folder name
+_INSTANCE_ID_TRANSLATION = str.maketrans({" ": "", "(": "_", ")": "_", ",": "_", "/": "_"})
+
+
+def _build_sbatch_script(cmd, job_name, partition, outfile, errfile, n_nodes, n_tasks, n_cores, memory,
                          local_tmp_space):
     """Create shell script to submit to Slurm queue via `sbatch`
 
-    Returns path to sbatch script
+    Returns contents of sbatch script, which is passed to `sbatch` on stdin
 
     """
 
@@ -43,69 +51,176 @@ def _build_sbatch_script(tmp_dir, cmd, job_name, partition, outfile, errfile, n_
 {singleton_flag}
 {conda_exe} run -n {conda_env} {cmd}
     """
-    sbatch_script = os.path.join(tmp_dir, job_name + ".sh")
-    with open(sbatch_script, "w") as f:
-        f.write(
-            sbatch_template.format(
-                cmd=cmd,
-                job_name=job_name,
-                partition=partition,
-                outfile=outfile,
-                errfile=errfile,
-                n_nodes=n_nodes,
-                n_tasks=n_tasks,
-                n_cores=n_cores,
-                memory=memory,
-                local_tmp_space=local_tmp_space,
-                singleton_flag=singleton_flag,
-                conda_exe=conda_exe,
-                conda_env=conda_env)
-        )
-    return sbatch_script
-
-
-def _parse_squeue_state(squeue_out, job_id):
-    """Parse "state" column from squeue output for given job_id
-
-    Returns state for the *first* job matching job_id. Returns 'u' if
-    `squeue` output is empty or job_id is not found.
+    return sbatch_template.format(
+        cmd=cmd,
+        job_name=job_name,
+        partition=partition,
+        outfile=outfile,
+        errfile=errfile,
+        n_nodes=n_nodes,
+        n_tasks=n_tasks,
+        n_cores=n_cores,
+        memory=memory,
+        local_tmp_space=local_tmp_space,
+        singleton_flag=singleton_flag,
+        conda_exe=conda_exe,
+        conda_env=conda_env)
+
+
+def _parse_squeue_states(squeue_out, job_ids):
+    """Parse "state" column from headerless `squeue -h -o "%i %t"` output
+
+    Returns a dictionary mapping each of job_ids to its state. Jobs that are
+    not found in the output are given the state 'u'.
 
     """
 
-    invalid_job_str = "Invalid job id specified"
-    if invalid_job_str in squeue_out:
-        return "u"
-
-    lines = squeue_out.split('\n')
-
-    for line in lines:
-        if "JOBID" in line:
+    states = {job_id: "u" for job_id in job_ids}
+    for line in squeue_out.split("\n"):
+        if len(line.strip()) == 0:
             continue
-        elif len(line.strip()) == 0:
+        fields = line.split()
+        try:
+            returned_id = int(fields[0])
+        except ValueError:
             continue
-        else:
-            returned_id = line.split()[0]
-            state = line.split()[4]
-            logger.debug("Squeue for job %i returned ID: %s, State: %s" % (job_id, returned_id, state))
-            return state
+        if returned_id in states:
+            logger.debug("Squeue for job %i returned State: %s" % (returned_id, fields[1]))
+            states[returned_id] = fields[1]
+    return states
+
+
+class _SqueuePoller:
+    """Polls Slurm for the state of all jobs submitted from this process with one `squeue` call
+
+    Every cycle, all registered jobs are queried together with `squeue -j id1,id2,...`. The interval between cycles
+    backs off exponentially (2, 2, 4, 8, ... seconds, capped at 60 seconds) and goes back to 2 seconds whenever a new job
+    is registered. After each cycle, the state of each job is updated and its event is set so that the waiting task can
+    act on it.
+
+    Only jobs submitted from the same process share a call. Luigi runs each task in its own worker process, so with
+    multiple workers each process typically tracks a single job.
+
+    """
+
+    min_interval = 2
+    max_interval = 60
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._interval = self.min_interval
+        self._next_poll = None
+        self._thread = None
+
+    def register(self, job_id):
+        with self._cond:
+            event = threading.Event()
+            self._jobs[job_id] = {"event": event, "state": None}
+            # Check on the new job soon, then back off again
+            self._interval = self.min_interval
+            next_poll = time.monotonic() + self.min_interval
+            if self._next_poll is None or next_poll < self._next_poll:
+                self._next_poll = next_poll
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="squeue-poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return event
+
+    def unregister(self, job_id):
+        with self._cond:
+            self._jobs.pop(job_id, None)
+
+    def get_state(self, job_id):
+        with self._cond:
+            return self._jobs[job_id]["state"]
+
+    def _query(self, job_ids):
+        cmd = ["squeue", "-h", "-o", "%i %t", "-j", ",".join(str(job_id) for job_id in job_ids)]
+        output = subprocess.run(cmd, capture_output=True)
+        stdout = output.stdout.decode("utf-8")
+        if output.returncode == 0:
+            return _parse_squeue_states(stdout, job_ids)
+        if "Invalid job id specified" not in output.stderr.decode("utf-8"):
+            raise RuntimeError(output.stderr.decode("utf-8"))
+        # Slurm rejects the whole request if any job has left the queue, so fall back to querying one at a time
+        if len(job_ids) == 1:
+            return {job_ids[0]: "u"}
+        states = {}
+        for job_id in job_ids:
+            states.update(self._query([job_id]))
+        return states
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._jobs) == 0:
+                    self._thread = None
+                    self._next_poll = None
+                    return
+                now = time.monotonic()
+                if self._next_poll > now:
+                    self._cond.wait(self._next_poll - now)
+                    continue
+                job_ids = list(self._jobs)
+
+            logger.info("Checking status of jobs %s..." % ", ".join(str(job_id) for job_id in job_ids))
+            try:
+                states = self._query(job_ids)
+            except Exception as e:
+                logger.warning(f"squeue failed for jobs {job_ids}: {e}")
+                states = {}
+
+            with self._cond:
+                for job_id, state in states.items():
+                    job = self._jobs.get(job_id)
+                    if job is not None:
+                        job["state"] = state
+                        job["event"].set()
+                self._next_poll = time.monotonic() + self._interval
+                self._interval = min(self.max_interval, self._interval * 2)
 
-    return "u"
+
+_squeue_poller = _SqueuePoller()
 
 
 def _get_sbatch_errors(errfile):
     """Checks error file for errors and returns result
 
-    Returns contents of error file.  Returns empty string if empty.
+    Returns contents of error file.  Returns empty string if empty.  A missing
+    error file means the job never ran (e.g. it was cancelled while pending),
+    so that is returned as an error too.
 
     """
-    errors = ""
     if not os.path.exists(errfile):
         logger.info("No error file found at %s" % errfile)
-    with open(errfile, "r") as f:
-        errors = f.read()
+        return "No error file found at %s" % errfile
+    with open(errfile, "rb") as f:
+        errors = f.read().decode("utf-8", errors="replace")
     return errors
 
 
+def _get_sacct_state(job_id):
+    """Look up the final state of a job that has left the queue using `sacct`
+
+    Returns the state (e.g. COMPLETED, FAILED, TIMEOUT) or None if it can't be
+    determined.
+
+    """
+    cmd = ["sacct", "-j", str(job_id), "-X", "-n", "-P", "-o", "State"]
+    try:
+        output = subprocess.run(cmd, capture_output=True)
+    except OSError as e:
+        logger.warning(f"sacct failed for job {job_id}: {e}")
+        return None
+    lines = output.stdout.decode("utf-8").split()
+    if output.returncode != 0 or len(lines) == 0:
+        logger.warning(f"sacct returned no state for job {job_id}")
+        return None
+    return lines[0]
+
+
 class SlurmJobTask(luigi.Task):
 
     # Luigi parameters that can be passed in to the task
@@ -131,12 +246,40 @@ class SlurmJobTask(luigi.Task):
     tmp_dir = ""
     local_tmp_dir = ""
 
+    # (pid, WorkflowManager) so that a forked Luigi worker doesn't reuse the parent's database client
+    _wm = None
+
+    # Attributes that only make sense in the process that set them, so they are left out of the pickled task
+    _process_local_attrs = ("_wm",)
+
+    @property
+    def wm(self):
+        """WorkflowManager for this task, built once per process and shared by output() and work()"""
+        if self._wm is None or self._wm[0] != os.getpid():
+            self._wm = (os.getpid(), WorkflowManager(config_path=self.config_path, acquisition_id=self.acquisition_id,
+                                                     stream_path=self.stream_path, dcid=self.dcid,
+                                                     orbit_id=self.orbit_id))
+        return self._wm[1]
+
+    def _get_config_wm(self):
+        """Reuse this process's WorkflowManager if there is one. Otherwise, build one without any ids since only the
+        config is needed and looking up the acquisition, stream, etc. would be extra DB work."""
+        if self._wm is not None and self._wm[0] == os.getpid():
+            return self._wm[1]
+        return WorkflowManager(config_path=self.config_path)
+
     def _dump(self, out_dir=''):
         """Dump instance to file."""
+        # Leave out per-process caches (e.g. the WorkflowManager and its database client) and let the compute node
+        # build its own
+        saved = {attr: self.__dict__.pop(attr) for attr in self._process_local_attrs if attr in self.__dict__}
         with self.no_unpicklable_properties():
             self.job_file = os.path.join(out_dir, 'job-instance.pickle')
             logger.debug("Pickling to file: %s" % self.job_file)
-            pickle.dump(self, open(self.job_file, "wb"), protocol=2)
+            # The pickle is read back on a compute node from the shared filesystem, so keep it small
+            with gzip.open(self.job_file, "wb", compresslevel=3) as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.__dict__.update(saved)
 
     def _set_task_tmp_id(self):
         if len(self.acquisition_id) > 0:
@@ -153,12 +296,10 @@ class SlurmJobTask(luigi.Task):
     def _set_task_instance_id(self):
         timestamp = datetime.datetime.now().strftime("%Y%m%dt%H%M%S")
         instance_id = self.task_tmp_id + "_" + self.task_family + "_" + timestamp
-        for b, a in [(' ', ''), ('(', '_'), (')', '_'), (',', '_'), ('/', '_')]:
-            instance_id = instance_id.replace(b, a)
-        self.task_instance_id = instance_id
+        self.task_instance_id = instance_id.translate(_INSTANCE_ID_TRANSLATION)
 
     def _init_local(self):
-        wm = WorkflowManager(config_path=self.config_path)
+        wm = self._get_config_wm()
         # Create tmp folder
         self.tmp_dir = os.path.join(wm.scratch_tmp_dir, self.task_instance_id)
         wm.makedirs(self.tmp_dir)
@@ -189,56 +330,56 @@ class SlurmJobTask(luigi.Task):
         # Build sbatch script
         self.outfile = os.path.join(self.tmp_dir, 'job.out')
         self.errfile = os.path.join(self.tmp_dir, 'job.err')
-        sbatch_script = _build_sbatch_script(self.tmp_dir, job_str, self.task_family, self.partition, self.outfile,
-                                             self.errfile, self.n_nodes, self.n_tasks, self.n_cores, self.memory,
+        sbatch_script = _build_sbatch_script(job_str, self.task_family, self.partition, self.outfile, self.errfile,
+                                             self.n_nodes, self.n_tasks, self.n_cores, self.memory,
                                              self.local_tmp_space)
-        logger.debug('sbatch script: ' + sbatch_script)
+        logger.debug('sbatch script:\n' + sbatch_script)
 
-        # Submit the job and grab job ID
-        output = subprocess.check_output("sbatch " + sbatch_script, shell=True)
-        self.job_id = int(output.decode("utf-8").split(" ")[-1])
+        # Submit the job on stdin and grab job ID
+        output = subprocess.run(["sbatch"], input=sbatch_script.encode("utf-8"), capture_output=True, check=True)
+        self.job_id = int(output.stdout.decode("utf-8").split()[-1])
         logger.info("%s %s submitted with job id %i" % (self.task_tmp_id, self.task_family, self.job_id))
 
         self._track_job()
 
     def _track_job(self):
-        while True:
-            # Sleep for a little bit
-            # time.sleep(random.randint(POLL_TIME_RANGE[0], POLL_TIME_RANGE[1]))
-            time.sleep(random.randint(25, 40))
-
-            # See what the job's up to
-            logger.info("Checking status of job %i..." % self.job_id)
-            try:
-                squeue_out = subprocess.check_output(["squeue", "-j", str(self.job_id)]).decode("utf-8")
-            except Exception as e:
-                logger.warning(f"squeue failed for job {self.job_id}")
-                continue
-            logger.debug("squeue_out is\n %s" % squeue_out)
-            slurm_status = _parse_squeue_state(squeue_out, self.job_id)
-            if slurm_status == "PD":
-                logger.info("%s %s with job id %i is PENDING..." % (self.task_tmp_id, self.task_family, self.job_id))
-            if slurm_status == "R":
-                logger.info("%s %s with job id %i is RUNNING..." % (self.task_tmp_id, self.task_family, self.job_id))
-            if slurm_status == "S":
-                logger.info("%s %s with job id %i is SUSPENDED..." % (self.task_tmp_id, self.task_family, self.job_id))
-            if slurm_status == "u":
-                errors = _get_sbatch_errors(self.errfile)
-                # If no errors, then must be finished
-                if not errors:
-                    logger.info("%s %s with job id %i has COMPLETED WITH NO ERRORS " % (self.task_tmp_id,
-                                                                                        self.task_family, self.job_id))
-                else:  # then we have completed with errors
-                    logger.info("%s %s with job id %i has COMPLETED WITH ERRORS/WARNINGS " % (self.task_tmp_id,
-                                                                                              self.task_family,
-                                                                                              self.job_id))
-                    raise RuntimeError(errors)
-                break
-            # TODO: Add the rest of the states from https://slurm.schedmd.com/squeue.html
+        event = _squeue_poller.register(self.job_id)
+        try:
+            while True:
+                # Wait until the poller has a new status for this job
+                event.wait()
+                event.clear()
+                slurm_status = _squeue_poller.get_state(self.job_id)
+                if slurm_status == "PD":
+                    logger.info(f"{self.task_tmp_id} {self.task_family} with job id {self.job_id} is PENDING...")
+                if slurm_status == "R":
+                    logger.info(f"{self.task_tmp_id} {self.task_family} with job id {self.job_id} is RUNNING...")
+                if slurm_status == "S":
+                    logger.info(f"{self.task_tmp_id} {self.task_family} with job id {self.job_id} is SUSPENDED...")
+                if slurm_status == "u":
+                    errors = _get_sbatch_errors(self.errfile)
+                    # Check the accounting DB once in case the job failed without writing to its error file
+                    sacct_state = _get_sacct_state(self.job_id)
+                    if not errors and sacct_state in SLURM_FAILURE_STATES:
+                        errors = f"Job {self.job_id} ended with Slurm state {sacct_state}"
+                    # If no errors, then must be finished
+                    if not errors:
+                        logger.info("%s %s with job id %i has COMPLETED WITH NO ERRORS " % (self.task_tmp_id,
+                                                                                            self.task_family,
+                                                                                            self.job_id))
+                    else:  # then we have completed with errors
+                        logger.info("%s %s with job id %i has COMPLETED WITH ERRORS/WARNINGS " % (self.task_tmp_id,
+                                                                                                  self.task_family,
+                                                                                                  self.job_id))
+                        raise RuntimeError(errors)
+                    break
+                # TODO: Add the rest of the states from https://slurm.schedmd.com/squeue.html
+        finally:
+            _squeue_poller.unregister(self.job_id)
 
     def run(self):
 
-        wm = WorkflowManager(config_path=self.config_path)
+        wm = self._get_config_wm()
         self._set_task_tmp_id()
         self._set_task_instance_id()
         self._init_local()
@@ -254,7 +395,11 @@ class SlurmJobTask(luigi.Task):
         else:
             # Run the job
             logger.debug("Running task with Slurm: %s" % self.task_family)
-            self._run_job()
+            try:
+                self._run_job()
+            finally:
+                # The job updated the DB from a compute node, so don't trust any cached query results
+                wm.database_manager.invalidate()
 
     def work(self):
         """Override this method, rather than ``run()``,  for your actual work."""
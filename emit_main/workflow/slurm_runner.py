@@ -1,9 +1,7 @@
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-
+import gzip
+import mmap
 import os
+import pickle
 import shutil
 import sys
 import warnings
@@ -12,6 +10,8 @@ from emit_main.workflow.workflow_manager import WorkflowManager
 
 warnings.filterwarnings("ignore")
 
+GZIP_MAGIC = b"\x1f\x8b"
+
 
 def _do_work_on_compute_node(work_dir):
 
@@ -19,8 +19,13 @@ def _do_work_on_compute_node(work_dir):
     os.chdir(work_dir)
     # sys.path.insert(0, work_dir)
     # print(f"sys.path: {sys.path}")
-    with open("job-instance.pickle", "rb") as f:
-        job = pickle.load(f)
+    # The pickle is gzip compressed, but fall back to reading it directly if it was written uncompressed
+    # Map the file rather than reading it into memory first
+    with open("job-instance.pickle", "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:2] == GZIP_MAGIC:
+            job = pickle.loads(gzip.decompress(mm))
+        else:
+            job = pickle.loads(mm)
 
     # Set up local tmp dir
     wm = WorkflowManager(config_path=job.config_path)
@@ -47,12 +52,15 @@ def _do_work_on_compute_node(work_dir):
         print("Encountered error with task:  %s" % job)
         error_task_dir = job.tmp_dir.replace("/local/", "/error/")
         error_tmp_dir = error_task_dir + "_tmp"
-        print(f"Copying local tmp folder {job.local_tmp_dir} to {error_tmp_dir}")
-        wm.copytree(job.local_tmp_dir, error_tmp_dir)
+        # Moving is a rename when both are on the same filesystem and falls back to copy and delete otherwise
+        print(f"Moving local tmp folder {job.local_tmp_dir} to {error_tmp_dir}")
+        wm.move(job.local_tmp_dir, error_tmp_dir)
         raise e
     finally:
         # Delete local tmp folder in all cases except when running on debug partition with DEBUG level
-        if job.partition != "debug" or (job.partition == "debug" and job.level != "DEBUG"):
+        # The folder will already be gone if it was moved to the "error" folder above
+        if os.path.exists(job.local_tmp_dir) and \
+                (job.partition != "debug" or (job.partition == "debug" and job.level != "DEBUG")):
             print(f"Deleting task's local tmp folder: {job.local_tmp_dir}")
             shutil.rmtree(job.local_tmp_dir)
 